@@ -43,14 +43,141 @@
 #
 # =================================================================
 
+from collections import deque
+from concurrent.futures import as_completed, ProcessPoolExecutor
+import logging
+import multiprocessing
 import os
 
 import click
 
 from woudc_data_registry.processing import Process
 
+LOGGER = logging.getLogger(__name__)
 
-def orchestrate(file_, directory, verify_only=False, bypass=False):
+_PROCESS = None
+
+
+def _iter_files(directory):
+    """
+    walk a directory tree, yielding the path of every file in it
+    (like `os.walk`, directories which cannot be listed are skipped)
+
+    :param directory: directory to walk (recursive)
+
+    :returns: generator of filepaths
+    """
+
+    dirs = deque([directory])
+
+    while dirs:
+        directory = dirs.popleft()
+        try:
+            with os.scandir(directory) as it:
+                entries = list(it)
+        except OSError as err:
+            msg = 'Cannot list directory {}: {}'.format(directory, err)
+            LOGGER.error(msg)
+            continue
+
+        for entry in entries:
+            # as with os.walk, everything but directories is listed, and
+            # symlinks to directories are not followed
+            if not entry.is_dir():
+                yield entry.path
+            elif not entry.is_symlink():
+                dirs.append(entry.path)
+
+
+def _get_process():
+    """
+    get the processor shared by all files handled in this (worker) process
+
+    :returns: `woudc_data_registry.processing.Process`
+    """
+
+    global _PROCESS
+
+    if _PROCESS is None:
+        _PROCESS = Process()
+
+    return _PROCESS
+
+
+def _init_worker():
+    """
+    worker process initializer: build the processor up front so that
+    database and search engine connections are ready before the first file
+
+    :returns: void
+    """
+
+    _get_process()
+
+
+def _get_mp_context():
+    """
+    get the multiprocessing context for worker processes
+
+    forkserver (where available) forks workers from a clean server process
+    which has already imported the processing modules, instead of
+    re-importing them per worker or inheriting the parent's connections
+
+    :returns: `multiprocessing` context or `None` for the platform default
+    """
+
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return None
+
+    ctx = multiprocessing.get_context('forkserver')
+    ctx.set_forkserver_preload(['woudc_data_registry.controller'])
+
+    return ctx
+
+
+def _process_file(file_to_process, verify_only=False, bypass=False,
+                  process=None, interactive=True):
+    """
+    process a single file (safe to run in a worker process)
+
+    :param file_to_process: file to process
+    :param verify_only: whether to verify the file for correctness without
+                        processing
+    :param bypass: skip permission prompts
+    :param process: processor to reuse (default=per process instance)
+    :param interactive: whether permission prompts can be answered
+                        (default=True; workers have no terminal)
+
+    :returns: `tuple` of file, `bool` of processing result and status message
+    """
+
+    p = process or _get_process()
+    try:
+        result = p.process_data(file_to_process,
+                                verify_only=verify_only, bypass=bypass,
+                                interactive=interactive)
+
+        if result:  # processed
+            if verify_only:
+                message = 'Verified but not ingested'
+            else:
+                message = 'Ingested successfully'
+        else:
+            message = 'Not ingested'
+    except Exception as err:
+        result = False
+        message = 'Processing failed: {}'.format(err)
+
+    if not result or verify_only:
+        # nothing was committed; do not hold a transaction open until
+        # the next file
+        p.registry.session.rollback()
+
+    return file_to_process, result, message
+
+
+def orchestrate(file_, directory, verify_only=False, bypass=False, jobs=1,
+                verbose=False):
     """
     core orchestation workflow
 
@@ -58,36 +185,63 @@ def orchestrate(file_, directory, verify_only=False, bypass=False):
     :param directory: directory to process (recursive)
     :param verify_only: whether to verify the file for correctness without
                         processing
+    :param bypass: skip permission prompts
+    :param jobs: number of worker processes (default=1, no parallelism)
+    :param verbose: report every file, not only failures (always the case
+                    when permission prompts are possible)
 
-    :returns: void
+    :returns: `tuple` of lists of passed and failed files
     """
 
     files_to_process = []
+    passed = []
+    failed = []
 
     if file_ is not None:
         files_to_process = [file_]
     elif directory is not None:
-        for root, dirs, files in os.walk(directory):
-            for f in files:
-                files_to_process.append(os.path.join(root, f))
-
-    with click.progressbar(files_to_process, label='Processing files') as run_:
-        for file_to_process in run_:
-            click.echo('Processing filename: {}'.format(file_to_process))
-            p = Process()
-            try:
-                result = p.process_data(file_to_process,
-                                        verify_only=verify_only, bypass=bypass)
-
-                if result:  # processed
-                    if verify_only:
-                        click.echo('Verified but not ingested')
-                    else:
-                        click.echo('Ingested successfully')
-                else:
-                    click.echo('Not ingested')
-            except Exception as err:
-                click.echo('Processing failed: {}'.format(err))
+        files_to_process = list(_iter_files(directory))
+
+    with click.progressbar(length=len(files_to_process),
+                           label='Processing files') as run_:
+        if jobs > 1 and len(files_to_process) > 1:
+            with ProcessPoolExecutor(max_workers=jobs,
+                                     mp_context=_get_mp_context(),
+                                     initializer=_init_worker) as executor:
+                futures = [executor.submit(_process_file, file_to_process,
+                                           verify_only, bypass,
+                                           interactive=False)
+                           for file_to_process in files_to_process]
+                results = (future.result() for future in
+                           as_completed(futures))
+                for file_to_process, result, message in results:
+                    if verbose or not result:
+                        click.echo('Processing filename: {}\n{}'.format(
+                            file_to_process, message))
+                    (passed if result else failed).append(file_to_process)
+                    run_.update(1)
+        else:
+            process = Process()
+            # permission prompts must follow the filename they concern
+            announce = verbose or not bypass
+            for file_to_process in files_to_process:
+                if announce:
+                    click.echo('Processing filename: {}'.format(
+                        file_to_process))
+                file_to_process, result, message = _process_file(
+                    file_to_process, verify_only=verify_only, bypass=bypass,
+                    process=process)
+                if announce:
+                    click.echo(message)
+                elif not result:
+                    click.echo('Processing filename: {}\n{}'.format(
+                        file_to_process, message))
+                (passed if result else failed).append(file_to_process)
+                run_.update(1)
+
+    click.echo('Passed: {}, failed: {}'.format(len(passed), len(failed)))
+
+    return passed, failed
 
 
 @click.group()
@@ -107,7 +261,11 @@ def data():
               help='Path to directory of data records')
 @click.option('--bypass', '-b', 'bypass', is_flag=True,
               help='Bypass permission prompts while ingesting')
-def ingest(ctx, file_, directory, bypass):
+@click.option('--jobs', '-j', 'jobs', type=click.IntRange(min=1), default=1,
+              help='Number of files to process in parallel (requires -b)')
+@click.option('--verbose', '-v', 'verbose', is_flag=True,
+              help='Report every file, not only failures')
+def ingest(ctx, file_, directory, bypass, jobs, verbose):
     """ingest a single data submission or directory of files"""
 
     if file_ is not None and directory is not None:
@@ -118,10 +276,14 @@ def ingest(ctx, file_, directory, bypass):
         msg = 'One of --file or --directory is required'
         raise click.ClickException(msg)
 
+    if jobs > 1 and not bypass:
+        msg = '--jobs requires --bypass (workers cannot prompt)'
+        raise click.ClickException(msg)
+
     if bypass:
-        orchestrate(file_, directory, bypass=True)
+        orchestrate(file_, directory, bypass=True, jobs=jobs, verbose=verbose)
     else:
-        orchestrate(file_, directory)
+        orchestrate(file_, directory, verbose=verbose)
 
 
 @click.command()
@@ -133,7 +295,12 @@ def ingest(ctx, file_, directory, bypass):
               type=click.Path(exists=True, resolve_path=True,
                               dir_okay=True, file_okay=False),
               help='Path to directory of data records')
-def verify(ctx, file_, directory):
+@click.option('--jobs', '-j', 'jobs', type=click.IntRange(min=1), default=1,
+              help='Number of files to process in parallel (files which '
+                   'would need a permission prompt fail)')
+@click.option('--verbose', '-v', 'verbose', is_flag=True,
+              help='Report every file, not only failures')
+def verify(ctx, file_, directory, jobs, verbose):
     """verify a single data submission or directory of files"""
 
     if file_ is not None and directory is not None:
@@ -144,7 +311,8 @@ def verify(ctx, file_, directory):
         msg = 'One of --file or --directory is required'
         raise click.ClickException(msg)
 
-    orchestrate(file_, directory, verify_only=True)
+    orchestrate(file_, directory, verify_only=True, jobs=jobs,
+                verbose=verbose)
 
 
 data.add_command(ingest)
@@ -50,8 +50,8 @@ import click
 import csv
 import json
 from sqlalchemy import (Boolean, Column, create_engine, Date, DateTime,
-                        Float, Enum, ForeignKey, Integer, String, Time,
-                        UniqueConstraint)
+                        Float, Enum, ForeignKey, Index, Integer, String,
+                        Time, UniqueConstraint)
 from sqlalchemy.exc import OperationalError, ProgrammingError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
@@ -208,6 +208,9 @@ class Instrument(base):
     """Data Registry Instrument"""
 
     __tablename__ = 'instruments'
+    # matches the new serial lookup in processing (all but the serial)
+    __table_args__ = (Index('ix_instruments_lookup', 'name', 'model',
+                            'station_id', 'dataset_id'),)
 
     identifier = Column(String, primary_key=True)
     station_id = Column(String, ForeignKey('stations.identifier'),
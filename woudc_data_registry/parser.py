@@ -44,13 +44,20 @@
 # =================================================================
 
 import csv
-from datetime import datetime, time
+from datetime import date, datetime, time
+import functools
 import logging
+import re
 import sys
 import yaml
 
 from io import StringIO
 
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:  # PyYAML built without libyaml
+    from yaml import SafeLoader
+
 LOGGER = logging.getLogger(__name__)
 
 ERROR_CODES = {
@@ -82,6 +89,78 @@ DOMAINS = {
     }
 }
 
+# values accepted by float()/int() (as typed by _get_value_type)
+_FLOAT_RE = re.compile(r'\s*[+-]?(\d+\.\d*|\.\d+)([eE][+-]?\d+)?\s*')
+_INT_RE = re.compile(r'\s*[+-]?\d+\s*')
+
+_REQUIRED_TABLES = frozenset(DOMAINS['metadata_tables'])
+_REQUIRED_FIELDS = {table: frozenset(fields) for table, fields
+                    in DOMAINS['metadata_tables'].items()}
+
+
+@functools.lru_cache(maxsize=1)
+def _load_dataset_tables(dataset_tables='./data/tables.yaml'):
+    """
+    load dataset table definitions (parsed once per process)
+
+    :param dataset_tables: path to dataset table definitions
+
+    :returns: `dict` of dataset table definitions
+    """
+
+    LOGGER.debug('Loading dataset table definitions {}'.format(
+        dataset_tables))
+
+    with open(dataset_tables) as yamlfile:
+        tables = yaml.load(yamlfile, Loader=SafeLoader)
+
+    _freeze_table_fields(tables)
+    return tables
+
+
+def _freeze_table_fields(definitions):
+    """
+    convert table field lists of dataset definitions to frozensets in place,
+    so that validation does not rebuild them for every file
+
+    :param definitions: `dict` of (nested) dataset table definitions
+
+    :returns: `None`
+    """
+
+    for key, value in definitions.items():
+        if key in ['required', 'optional']:
+            for table, fields in value.items():
+                value[table] = frozenset(fields)
+        elif isinstance(value, dict):
+            _freeze_table_fields(value)
+
+
+def _iter_rows(content):
+    """
+    tokenize Extended CSV content into rows
+
+    :param content: buffer or open text stream of Extended CSV data
+
+    :returns: generator of `tuple` of line number and `list` of row values
+    """
+
+    if isinstance(content, str) and '"' not in content \
+            and '\r' not in content:
+        # without quoting or carriage returns, splitting on commas is
+        # equivalent to csv.reader
+        lines = content.split('\n')
+        if not lines[-1]:  # trailing newline (or empty buffer)
+            lines.pop()
+        for line_num, line in enumerate(lines, 1):
+            yield line_num, line.split(',') if line else []
+    else:
+        if isinstance(content, str):
+            content = StringIO(content)
+        reader = csv.reader(content)
+        for row in reader:
+            yield reader.line_num, row
+
 
 def _get_value_type(field, value):
     """
@@ -94,30 +173,81 @@ def _get_value_type(field, value):
     """
 
     field2 = field.lower()
+
+    if field2 not in ('date', 'time'):  # typed by value alone
+        field2 = None
+
+    return _get_typed_value(field2, value)
+
+
+@functools.lru_cache(maxsize=4096)
+def _get_typed_value(field2, value):
+    """
+    derive true type from data value (memoized; all results are immutable)
+
+    :param field2: `date`, `time` or `None` for any other field
+    :param value: value to be evaluated
+
+    :returns: value with appropriate typing
+    """
+
     value2 = None
 
     if value == '':  # empty
         return None
 
     if field2 == 'date':
-        value2 = datetime.strptime(value, '%Y-%m-%d').date()
+        if (len(value) == 10 and value[4] == value[7] == '-' and
+                value.replace('-', '').isdigit()):  # YYYY-MM-DD fast path
+            value2 = date(int(value[:4]), int(value[5:7]), int(value[8:]))
+        else:
+            value2 = datetime.strptime(value, '%Y-%m-%d').date()
     elif field2 == 'time':
-        hour, minute, second = [int(v) for v in value.split(':')]
-        value2 = time(hour, minute, second)
-    else:
-        try:
-            if '.' in value:  # float?
-                value2 = float(value)
-            elif len(value) > 1 and value.startswith('0'):
-                value2 = value
-            else:  # int?
-                value2 = int(value)
-        except ValueError:  # string (default)?
-            value2 = value
+        if (len(value) == 8 and value[2] == value[5] == ':' and
+                value.replace(':', '').isdigit()):  # HH:MM:SS fast path
+            value2 = time(int(value[:2]), int(value[3:5]), int(value[6:]))
+        else:
+            hour, minute, second = [int(v) for v in value.split(':')]
+            value2 = time(hour, minute, second)
+    elif '.' in value:  # float?
+        value2 = float(value) if _FLOAT_RE.fullmatch(value) else value
+    elif len(value) > 1 and value.startswith('0'):
+        value2 = value
+    elif _INT_RE.fullmatch(value):  # int?
+        value2 = int(value)
+    else:  # string (default)
+        value2 = value
 
     return value2
 
 
+@functools.lru_cache(maxsize=256)
+def _resolve_dataset_schema(dataset, level, form):
+    """
+    look up the table definitions of a dataset (cached per CONTENT triple)
+
+    :param dataset: #CONTENT.Category
+    :param level: #CONTENT.Level
+    :param form: #CONTENT.Form
+
+    :returns: `tuple` of table definitions `dict` (or `None`) and
+              error message (or `None`)
+    """
+
+    tables = _load_dataset_tables()
+
+    if dataset not in tables.keys():
+        return None, '#CONTENT.Category not valid.'
+    curr_dict = tables[dataset]
+    if level not in curr_dict.keys():
+        return None, '#CONTENT.Level not valid.'
+    curr_dict = curr_dict[level]
+    if form not in curr_dict:
+        return None, '#CONTENT.Form not valid.'
+
+    return curr_dict[form], None
+
+
 class ExtendedCSV(object):
     """
 
@@ -131,7 +261,7 @@ class ExtendedCSV(object):
         """
         read WOUDC Extended CSV file
 
-        :param content: buffer of Extended CSV data
+        :param content: buffer or open text stream of Extended CSV data
 
         :returns: `woudc_data_registry.parser.ExtendedCSV`
         """
@@ -139,65 +269,89 @@ class ExtendedCSV(object):
         self.extcsv = {}
         self.number_of_observations = 0
         self._raw = None
+        self._fields = {}
+        self._line_nums = {}
 
-        LOGGER.debug('Reading into csv')
-        self._raw = content
-        reader = csv.reader(StringIO(self._raw))
+        if isinstance(content, str):
+            self._raw = content
 
         found_table = False
         table_name = None
+        table_values = {}
+        fields = values = None
+        date_time_fields = []
+
+        # checked once: the per-line debug messages below are otherwise
+        # formatted and dispatched for every table, comment and blank line
+        debug = LOGGER.isEnabledFor(logging.DEBUG)
 
         LOGGER.debug('Parsing object model')
-        for row in reader:
-            if len(row) == 1 and row[0].startswith('#'):  # table name
+        for line_num, row in _iter_rows(content):
+            row_length = len(row)
+            first = row[0][:1] if row_length else ''
+
+            if row_length == 1 and first == '#':  # table name
                 table_name = row[0].replace('#', '')
                 table_count = 2
                 while table_name in self.extcsv:
                     table_name = '{}_{}'.format(table_name, table_count)
                 # if table_name in DOMAINS['metadata_tables'].keys():
                 found_table = True
-                LOGGER.debug('Found new table {}'.format(table_name))
+                if debug:
+                    LOGGER.debug('Found new table {}'.format(table_name))
                 self.extcsv[table_name] = {}
             elif found_table:  # fetch header line
-                LOGGER.debug('Found new table header {}'.format(table_name))
-                LOGGER.warning(row)
-                self.extcsv[table_name]['_fields'] = row
+                if debug:
+                    LOGGER.debug('Found new table header {}'.format(
+                        table_name))
+                fields = self._fields[table_name] = row
+                values = table_values[table_name] = []
+                # date/time cells are the only ones which can fail typing
+                date_time_fields = [(i, field.lower()) for i, field
+                                    in enumerate(row)
+                                    if field.lower() in ('date', 'time')]
                 found_table = False
-            elif len(row) > 0 and row[0].startswith('*'):  # comment
-                LOGGER.debug('Found comment')
+            elif first == '*':  # comment
+                if debug:
+                    LOGGER.debug('Found comment')
                 continue
-            elif len(row) == 0:  # blank line
-                LOGGER.debug('Found blank line')
+            elif row_length == 0:  # blank line
+                if debug:
+                    LOGGER.debug('Found blank line')
                 continue
             else:  # process row data
                 if table_name is not None:
-                    self.extcsv[table_name]['_line_num'] = \
-                        int(reader.line_num + 1)
-                    for idx, val in enumerate(row):
-                        try:
-                            field = self.extcsv[table_name]['_fields'][idx]
-                        except IndexError:
-                            msg = ('Rows in table {} have too many '
-                                   'elements.'.format(table_name))
-                            LOGGER.error(msg)
-                            raise NonStandardDataError(msg)
-                        self.extcsv[table_name][field] = _get_value_type(field,
-                                                                         val)
+                    if row_length > len(fields):
+                        msg = ('Rows in table {} have too many '
+                               'elements.'.format(table_name))
+                        LOGGER.error(msg)
+                        raise NonStandardDataError(msg)
+                    self._line_nums[table_name] = line_num + 1
+                    # later rows overwrite earlier ones, so only keep the
+                    # raw values and type the survivors once parsing is
+                    # done, but still reject malformed dates/times in every
+                    # row (typing is memoized, so repeats are cheap)
+                    for i, field2 in date_time_fields:
+                        if i < row_length:
+                            _get_typed_value(field2, row[i])
+                    values[:row_length] = row
+
+        LOGGER.debug('Typing table values')
+        for table_name, values in table_values.items():
+            table = self.extcsv[table_name]
+            for field, val in zip(self._fields[table_name], values):
+                table[field] = _get_value_type(field, val)
 
     def gen_woudc_filename(self):
         """generate WOUDC filename convention"""
 
         timestamp = self.extcsv['TIMESTAMP']['Date'].strftime('%Y%m%d')
-        instrument_name = self.extcsv['INSTRUMENT']['Name']
-        instrument_model = self.extcsv['INSTRUMENT']['Model']
+        instrument = self.extcsv['INSTRUMENT']
+        instrument_name = instrument['Name']
+        instrument_model = instrument['Model']
 
-        if 'Number' in self.extcsv['INSTRUMENT']:
-            instrument_number = self.extcsv['INSTRUMENT']['Number']
-            if self.extcsv['INSTRUMENT']['Number'] is None:
-                instrument_number = 'na'
-            else:
-                instrument_number = self.extcsv['INSTRUMENT']['Number']
-        else:
+        instrument_number = instrument.get('Number')
+        if instrument_number is None:
             instrument_number = 'na'
 
         agency = self.extcsv['DATA_GENERATION']['Agency']
@@ -218,10 +372,10 @@ class ExtendedCSV(object):
 
         errors = []
         missing_tables = [table for table in DOMAINS['metadata_tables']
-                          if table not in self.extcsv.keys()]
+                          if table not in self.extcsv]
 
         if missing_tables:
-            if not list(set(DOMAINS['metadata_tables']) - set(missing_tables)):
+            if len(missing_tables) == len(_REQUIRED_TABLES):
                 msg = 'No core metadata tables found. Not an Extended CSV file'
                 LOGGER.error(msg)
                 raise NonStandardDataError(msg)
@@ -239,9 +393,8 @@ class ExtendedCSV(object):
         else:
             LOGGER.debug('No missing metadata tables.')
 
-        for key, value in DOMAINS['metadata_tables'].items():
-            missing_datas = list(set(value) -
-                                 set(self.extcsv[key].keys()))
+        for key, value in _REQUIRED_FIELDS.items():
+            missing_datas = value.difference(self.extcsv[key])
 
             if missing_datas:
                 for missing_data in missing_datas:
@@ -250,29 +403,41 @@ class ExtendedCSV(object):
                         'locator': missing_data,
                         'text': 'ERROR: {}: (line number: {})'.format(
                             ERROR_CODES['missing_data'],
-                            self.extcsv[key]['_line_num'])
+                            self._line_nums[key])
                     })
             else:
                 LOGGER.debug('No missing fields in table {}'.format(key))
 
-        if int(self.extcsv['LOCATION']['Latitude']) not in range(-90, 90):
+        location = self.extcsv['LOCATION']
+
+        try:
+            valid_latitude = -90 <= float(location['Latitude']) <= 90
+        except (TypeError, ValueError):
+            valid_latitude = False
+
+        if not valid_latitude:
             errors.append({
                 'code': 'invalid_data',
                 'locator': 'LOCATION.Latitude',
                 'text': 'ERROR: {}: {} (line number: {})'.format(
                     ERROR_CODES['invalid_data'],
-                    self.extcsv['LOCATION']['Latitude'],
-                    self.extcsv['LOCATION']['_line_num'])
+                    location['Latitude'],
+                    self._line_nums['LOCATION'])
             })
 
-        if int(self.extcsv['LOCATION']['Longitude']) not in range(-180, 180):
+        try:
+            valid_longitude = -180 <= float(location['Longitude']) <= 180
+        except (TypeError, ValueError):
+            valid_longitude = False
+
+        if not valid_longitude:
             errors.append({
                 'code': 'invalid_data',
                 'locator': 'LOCATION.Longitude',
                 'text': 'ERROR: {}: {} (line number: {})'.format(
                     ERROR_CODES['invalid_data'],
-                    self.extcsv['LOCATION']['Longitude'],
-                    self.extcsv['LOCATION']['_line_num'])
+                    location['Longitude'],
+                    self._line_nums['LOCATION'])
             })
 
         if self.check_dataset():
@@ -285,63 +450,44 @@ class ExtendedCSV(object):
             raise MetadataValidationError('Invalid metadata', errors)
 
     def check_dataset(self):
-        dataset_tables = './data/tables.yaml'
-
         dataset = self.extcsv['CONTENT']['Category']
         level = self.extcsv['CONTENT']['Level']
         form = self.extcsv['CONTENT']['Form']
 
-        with open(dataset_tables) as yamlfile:
-            tables = yaml.safe_load(yamlfile)
-
-        if dataset in tables.keys():
-            curr_dict = tables[dataset]
-            if level in curr_dict.keys():
-                curr_dict = curr_dict[level]
-                if form in curr_dict:
-                    curr_dict = curr_dict[form]
-                    if 1 in curr_dict.keys():
-                        for version in curr_dict:
-                            if self.check_tables(self.extcsv,
-                                                 curr_dict[version]):
-                                return True
-                        return False
-                    else:
-                        if self.check_tables(curr_dict):
-                            return True
-                        else:
-                            return False
-                else:
-                    msg = '#CONTENT.Form not valid.'
-                    LOGGER.error(msg)
-            else:
-                msg = '#CONTENT.Level not valid.'
-                LOGGER.error(msg)
-        else:
-            msg = '#CONTENT.Category not valid.'
+        curr_dict, msg = _resolve_dataset_schema(dataset, level, form)
+
+        if curr_dict is None:
             LOGGER.error(msg)
+            return False
 
-        return False
+        if 1 in curr_dict.keys():
+            for version in curr_dict:
+                if self.check_tables(curr_dict[version]):
+                    return True
+            return False
+        else:
+            if self.check_tables(curr_dict):
+                return True
+            else:
+                return False
 
     def check_tables(self, tables):
-        for key, value in self.extcsv.items():
-            value.pop('_line_num')
         for table in tables['required'].keys():
             if table in self.extcsv:
                 LOGGER.debug('Validating table {}..'.format(table))
                 # Consider adding order checking with orderdicts
-                missing = set(tables['required'][table])\
-                    - set(self.extcsv[table]['_fields'])
-                extra = set(self.extcsv[table]['_fields'])\
-                    - set(tables['required'][table])
+                required = tables['required'][table]
+                fields = set(self._fields.get(table, ()))
+                missing = required - fields
+                extra = fields - required
                 if missing:
                     msg = 'The following fields were missing from table {}'\
-                          ': {}'.format(table, missing)
+                          ': {}'.format(table, sorted(missing))
                     LOGGER.error(msg)
                     return False
                 elif extra:
                     msg = 'The following fields should not be in table {}'\
-                          ': {}'.format(table, extra)
+                          ': {}'.format(table, sorted(extra))
                     LOGGER.error(msg)
                     return False
                 else:
@@ -359,10 +505,6 @@ class ExtendedCSV(object):
                     LOGGER.warning('Optional table {} is not in file.'.format(
                                    table))
 
-        # delete transient fieldlist
-        for key, value in self.extcsv.items():
-            value.pop('_fields')
-
         return True
 
 
@@ -385,8 +527,8 @@ if __name__ == '__main__':
         print('Usage: {} <file>'.format(sys.argv[0]))
         sys.exit(1)
 
-    with open(sys.argv[1]) as fh:
-        ecsv = ExtendedCSV(fh.read())
+    with open(sys.argv[1], newline='') as fh:
+        ecsv = ExtendedCSV(fh)
     try:
         ecsv.validate_metadata()
     except MetadataValidationError as err:
@@ -48,13 +48,15 @@ import logging
 import os
 import shutil
 
+from sqlalchemy.exc import IntegrityError
+
 from woudc_data_registry import config, registry, search
 from woudc_data_registry.models import (Contributor, DataRecord, Dataset,
                                         Deployment, Instrument, Project,
                                         Station)
 from woudc_data_registry.parser import (ExtendedCSV, MetadataValidationError,
                                         NonStandardDataError)
-from woudc_data_registry.util import is_text_file, read_file
+from woudc_data_registry.util import read_text_file
 
 LOGGER = logging.getLogger(__name__)
 
@@ -80,34 +82,50 @@ class Process(object):
         self.process_start = datetime.utcnow()
         self.process_end = None
         self.registry = registry.Registry()
+        self._search_engine = None
+        self._distinct_cache = {}
+        self.instruments = set()
+        self._stations = {}
+        self._instrument_locations = set()
+
+    @property
+    def search_engine(self):
+        """search index, connected on first use (not needed to verify)"""
+
+        if self._search_engine is None:
+            self._search_engine = search.SearchIndex()
 
-    def process_data(self, infile, verify_only=False, bypass=False):
+        return self._search_engine
+
+    def process_data(self, infile, verify_only=False, bypass=False,
+                     interactive=True):
         """
         process incoming data record
 
         :param infile: incoming filepath
         :param verify_only: perform verification only (no ingest)
         :param bypass: skip permission prompts
+        :param interactive: whether permission prompts can be answered
+                            (if not, files needing one fail)
 
         :returns: `bool` of processing result
         """
 
+        # reset state left over from any previously processed file
+        self.status = None
+        self.code = None
+        self.message = None
+        self.process_start = datetime.utcnow()
+        self.process_end = None
+
         # detect incoming data file
         data = None
         self.data_record = None
-        self.search_engine = search.SearchIndex()
 
         LOGGER.info('Processing file {}'.format(infile))
         LOGGER.info('Detecting file')
-        if not is_text_file(infile):
-            self.status = 'failed'
-            self.code = 'NonStandardDataError'
-            self.message = 'binary file detected'
-            LOGGER.error('Unknown file: {}'.format(self.message))
-            return False
-
         try:
-            data = read_file(infile)
+            data = read_text_file(infile)
         except UnicodeDecodeError as err:
             self.status = 'failed'
             self.code = 'NonStandardDataError'
@@ -115,6 +133,13 @@ class Process(object):
             LOGGER.error('Unknown file: {}'.format(err))
             return False
 
+        if data is None:
+            self.status = 'failed'
+            self.code = 'NonStandardDataError'
+            self.message = 'binary file detected'
+            LOGGER.error('Unknown file: {}'.format(self.message))
+            return False
+
         LOGGER.info('Parsing data record')
         ecsv = ExtendedCSV(data)
 
@@ -180,7 +205,7 @@ class Process(object):
         LOGGER.info('Verifying data record against core metadata fields')
 
         LOGGER.debug('Validating project')
-        self.projects = self.registry.query_distinct(Project.identifier)
+        self.projects = self.query_reference_values(Project.identifier)
         if self.data_record.content_class not in self.projects:
             msg = 'Project {} not found in registry'.format(
                 self.data_record.content_class)
@@ -191,7 +216,7 @@ class Process(object):
                 self.data_record.content_class))
 
         LOGGER.debug('Validating dataset')
-        self.datasets = self.registry.query_distinct(Dataset.identifier)
+        self.datasets = self.query_reference_values(Dataset.identifier)
         if self.data_record.content_category not in self.datasets:
             msg = 'Dataset {} not found in registry'.format(
                 self.data_record.content_category)
@@ -202,7 +227,7 @@ class Process(object):
                 self.data_record.content_category))
 
         LOGGER.debug('Validating contributor')
-        self.contributors = self.registry.query_distinct(
+        self.contributors = self.query_reference_values(
             Contributor.identifier)
         file_contributor = '{}:{}'.format(
             self.data_record.data_generation_agency,
@@ -225,8 +250,7 @@ class Process(object):
         }
 
         LOGGER.debug('Validating station id...')
-        results = self.registry.query_multiple_fields(
-            Station, station, ['identifier'])
+        results = self.query_station(station['identifier'])
         if results:
             LOGGER.debug('Validated with id: {}'.format(
                 self.data_record.platform_id))
@@ -236,10 +260,10 @@ class Process(object):
             LOGGER.error(msg)
             raise ProcessingError(msg)
 
+        # name and country are compared against the station values fetched
+        # above rather than with one query per field
         LOGGER.debug('Validating station name...')
-        fields = ['identifier', 'name']
-        results = self.registry.query_multiple_fields(Station, station, fields)
-        if results:
+        if results[0] == station['name']:
             LOGGER.debug('Validated with name: {} for id: {}'.format(
                 self.data_record.platform_name, self.data_record.platform_id))
         else:
@@ -249,9 +273,7 @@ class Process(object):
             raise ProcessingError(msg)
 
         LOGGER.debug('Validating station country...')
-        fields = ['identifier', 'country_id']
-        results = self.registry.query_multiple_fields(Station, station, fields)
-        if results:
+        if results[1] == station['country_id']:
             LOGGER.debug('Validated with country: {} for id: {}'.format(
                 self.data_record.platform_country,
                 self.data_record.platform_id))
@@ -263,7 +285,6 @@ class Process(object):
             raise ProcessingError(msg)
 
         LOGGER.debug('Validating instrument')
-        self.instruments = self.registry.query_distinct(Instrument.identifier)
         instrument_added = False
         instrument = [self.data_record.instrument_name,
                       self.data_record.instrument_model,
@@ -271,42 +292,33 @@ class Process(object):
                       self.data_record.platform_id,
                       self.data_record.content_category]
         instrument_id = ':'.join(instrument)
-        if instrument_id not in self.instruments:
-            instrument[2] = str(int(instrument[2]))
-            old_instrument_id = ':'.join(instrument)
-            if old_instrument_id not in self.instruments:
-                msg = 'Instrument {} not found in registry'.format(
-                    instrument_id)
-                LOGGER.warning(msg)
-                LOGGER.debug('Checking for new serial number...')
-                instrument_added = self.new_serial(instrument_id, verify_only)
-                if not instrument_added:
-                    if bypass:
-                        LOGGER.info('Bypass mode. Skipping permission check.')
-                        ins_data = self.get_instrument_data(instrument_id)
-                        instrument = Instrument(ins_data)
-                        self.registry.save(instrument)
-                        LOGGER.info('Instrument successfully added.')
-                        instrument_added = True
-                    else:
-                        response = input('Not instrument with new serial. Add'
-                                         ' new instrument? (y/n)\n')
-                        if response == 'y':
-                            ins_data = self.get_instrument_data(instrument_id)
-                            instrument = Instrument(ins_data)
-                            self.registry.save(instrument)
-                            LOGGER.info('Instrument successfully added.')
-                            instrument_added = True
-                        else:
-                            msg = 'Instrument data for id:{} does not match '\
-                                  'existing records.'.format(instrument_id)
-                            LOGGER.error(msg)
-                            raise ProcessingError(msg)
-                LOGGER.debug('Updating instruments list.')
-                self.instruments = self.registry.\
-                    query_distinct(Instrument.identifier)
-            else:
-                instrument_id = old_instrument_id
+        # serials may be registered without leading zeros; both variants
+        # are checked against a single instruments lookup
+        instrument[2] = instrument[2].lstrip('0') or '0'
+        old_instrument_id = ':'.join(instrument)
+        matched_id = self.match_instrument([instrument_id,
+                                            old_instrument_id])
+        if matched_id is None:
+            msg = 'Instrument {} not found in registry'.format(
+                instrument_id)
+            LOGGER.warning(msg)
+            LOGGER.debug('Checking for new serial number...')
+            instrument_added = self.new_serial(instrument_id, verify_only)
+            if not instrument_added:
+                if bypass:
+                    LOGGER.info('Bypass mode. Skipping permission check.')
+                elif not self.confirm('Not instrument with new serial. Add'
+                                      ' new instrument?', interactive):
+                    msg = 'Instrument data for id:{} does not match '\
+                          'existing records.'.format(instrument_id)
+                    LOGGER.error(msg)
+                    raise ProcessingError(msg)
+                ins_data = self.get_instrument_data(instrument_id)
+                self.save_new(Instrument(ins_data))
+                LOGGER.info('Instrument successfully added.')
+                instrument_added = True
+        else:
+            instrument_id = matched_id
 
         if instrument_added and verify_only:
             LOGGER.debug('Skipping location check due to instrument '
@@ -320,8 +332,13 @@ class Process(object):
                 'y': self.data_record.y,
                 'z': self.data_record.z
             }
-            results = self.registry.query_multiple_fields(Instrument, location)
-            if results:
+            # instrument locations are not modified by ingest, so each
+            # matching location only needs to be confirmed once
+            location_key = tuple(location.values())
+            if location_key in self._instrument_locations:
+                LOGGER.debug('Instrument location already validated.')
+            elif self.registry.query_multiple_fields(Instrument, location):
+                self._instrument_locations.add(location_key)
                 LOGGER.debug('Instrument location validated.')
             else:
                 msg = 'Instrument location does not match database records.'
@@ -341,6 +358,21 @@ class Process(object):
         }
         deployment = self.registry.query_multiple_fields(
             Deployment, data, ['identifier'])
+        if not deployment:
+            LOGGER.warning('Deployment not found')
+            if bypass:
+                LOGGER.info('Bypass mode. Skipping permission check')
+            elif not self.confirm('Deployment {} not found. Add?'.format(
+                    deployment_id), interactive):
+                msg = 'Deployment {} not added. Skipping file.'.format(
+                    deployment_id)
+                LOGGER.error(msg)
+                raise ProcessingError(msg)
+            if self.save_new(Deployment(data)):
+                LOGGER.warning('Deployment {} added'.format(deployment_id))
+            else:  # added by another worker, which may need widening
+                deployment = self.registry.query_multiple_fields(
+                    Deployment, data, ['identifier'])
         if deployment:
             if deployment.start_date > self.data_record.timestamp_date:
                 deployment.start_date = self.data_record.timestamp_date
@@ -351,26 +383,6 @@ class Process(object):
                 self.registry.save()
                 LOGGER.debug('Deployment end date updated.')
             LOGGER.debug('Deployment validated')
-        else:
-            LOGGER.warning('Deployment not found')
-            if bypass:
-                LOGGER.info('Bypass mode. Skipping permission check')
-                deployment = Deployment(data)
-                self.registry.save(deployment)
-                LOGGER.warning('Deployment {} added'.format(
-                    deployment.identifier))
-            else:
-                response = input('Deployment {} not found. Add? (y/n)\n')
-                if response == 'y':
-                    deployment = Deployment(data)
-                    self.registry.save(deployment)
-                    LOGGER.warning('Deployment {} added'.format(
-                        deployment.identifier))
-                else:
-                    msg = 'Deployment {} not added. Skipping file.'.format(
-                        deployment.identifier)
-                    LOGGER.error(msg)
-                    raise ProcessingError(msg)
         LOGGER.info('Data record is valid and verified')
 
         if verify_only:  # do not save or index
@@ -387,13 +399,125 @@ class Process(object):
 
         LOGGER.info('Indexing data record search engine')
         version = self.search_engine.get_record_version(self.data_record.es_id)
+        # the lookup above already tells whether the record is indexed
         if version:
             if version < self.data_record.data_generation_version:
                 self.search_engine.index_data_record(
-                    self.data_record.__geo_interface__)
+                    self.data_record.__geo_interface__, exists=True)
         else:
             self.search_engine.index_data_record(
-                    self.data_record.__geo_interface__)
+                self.data_record.__geo_interface__,
+                exists=version is not None)
+        return True
+
+    def query_reference_values(self, domain):
+        """
+        queries for distinct values of static reference data (projects,
+        datasets, contributors), once per Process lifetime
+
+        :param domain: domain to be queried
+
+        :returns: `frozenset` of distinct values
+        """
+
+        key = str(domain)
+
+        if key not in self._distinct_cache:
+            self._distinct_cache[key] = frozenset(
+                self.registry.query_distinct(domain))
+
+        return self._distinct_cache[key]
+
+    def query_station(self, identifier):
+        """
+        queries a station by identifier (stations are static reference
+        data, so each is looked up once per Process lifetime)
+
+        Plain values are cached rather than the `Station` object, which
+        expires on rollback and is detached when the session is closed.
+
+        :param identifier: station identifier
+
+        :returns: `tuple` of station name and country, or `None` if not found
+        """
+
+        if identifier not in self._stations:
+            station = self.registry.query_multiple_fields(
+                Station, {'identifier': identifier})
+            if station is not None:
+                station = (station.name, station.country_id)
+            self._stations[identifier] = station
+
+        return self._stations[identifier]
+
+    def match_instrument(self, instrument_ids):
+        """
+        finds the first of several candidate instrument identifiers
+        that is in the registry
+
+        Known identifiers are remembered for the Process lifetime (ingest
+        never removes instruments); the registry is only queried, for the
+        candidates alone, on a miss so that instruments added since are
+        picked up.
+
+        :param instrument_ids: `list` of candidate instrument identifiers
+
+        :returns: matching instrument identifier, or `None`
+        """
+
+        if not self.instruments.intersection(instrument_ids):
+            LOGGER.debug('Querying registry for instruments.')
+            self.instruments.update(self.registry.query_existing(
+                Instrument.identifier, instrument_ids))
+
+        for instrument_id in instrument_ids:
+            if instrument_id in self.instruments:
+                return instrument_id
+
+        return None
+
+    def confirm(self, question, interactive=True):
+        """
+        asks the operator a yes/no permission question
+
+        :param question: question to ask
+        :param interactive: whether the operator can be asked (if not, the
+                            file cannot proceed)
+
+        :returns: `bool` of whether the answer is yes
+        """
+
+        if not interactive:
+            msg = '{} Cannot ask in non-interactive (parallel) mode;'\
+                  ' skipping file.'.format(question)
+            LOGGER.error(msg)
+            raise ProcessingError(msg)
+
+        return input('{} (y/n)\n'.format(question)) == 'y'
+
+    def save_new(self, obj):
+        """
+        saves a new registry object, tolerating the same object having been
+        added concurrently (e.g. by another ingest worker)
+
+        :param obj: new object with an `identifier` primary key
+
+        :returns: `bool` of whether the object was added (`False` if it
+                  already existed)
+        """
+
+        try:
+            self.registry.save(obj)
+        except IntegrityError:
+            self.registry.session.rollback()
+            model = type(obj)
+            if not self.registry.query_existing(model.identifier,
+                                                [obj.identifier]):
+                raise
+            LOGGER.warning('{} was added concurrently; keeping existing '
+                           'record'.format(obj))
+            return False
+
         return True
 
     def get_instrument_data(self, instrument_id):
@@ -426,8 +550,7 @@ class Process(object):
                 LOGGER.info('Verification mode detected. '
                             'Instrument not added.')
             else:
-                instrument = Instrument(data)
-                self.registry.save(instrument)
+                self.save_new(Instrument(data))
                 LOGGER.info('Instrument successfully added.')
             return True
         else:
@@ -80,6 +80,22 @@ class Registry(object):
 
         return values
 
+    def query_existing(self, domain, values):
+        """
+        queries which of the given values exist
+
+        :param domain: domain to be queried
+        :param values: `list` of values to look for
+
+        :returns: list of values found
+        """
+
+        LOGGER.debug('Querying {} for values {}'.format(domain, values))
+        results = [v[0] for v in
+                   self.session.query(domain).filter(domain.in_(values))]
+
+        return results
+
     def query_by_field(self, obj, obj_instance, by):
         """
         query data by field
@@ -152,29 +152,37 @@ class SearchIndex(object):
         except NotFoundError:
             return None
 
-    def index_data_record(self, data):
+    def index_data_record(self, data, exists=None):
         """
         index or update a document
 
         :param data: `dict` of GeoJSON representation
+        :param exists: whether the document is already indexed, if known
+                       (default None: look it up)
 
         :returns: `bool` status of indexing result
         """
 
         identifier = data['id']
 
-        try:
-            result = self.connection.get(index=INDEXES['data_record'],
-                                         doc_type='FeatureCollection',
-                                         id=identifier)
+        if exists is None:
+            try:
+                self.connection.get(index=INDEXES['data_record'],
+                                    doc_type='FeatureCollection',
+                                    id=identifier)
+                exists = True
+            except NotFoundError as err:
+                LOGGER.debug(err)
+                exists = False
+
+        if exists:
             LOGGER.debug('existing record, updating')
             data_ = json.dumps({'doc': data}, default=json_serial)
             result = self.connection.update(index=INDEXES['data_record'],
                                             doc_type='FeatureCollection',
                                             id=identifier, body=data_)
             LOGGER.debug('Result: {}'.format(result))
-        except NotFoundError as err:  # index new
-            LOGGER.debug(err)
+        else:  # index new
             LOGGER.info('new record, indexing')
             data_ = json.dumps(data, default=json_serial)
             LOGGER.debug('indexing {}'.format(identifier))
@@ -43,11 +43,19 @@
 #
 # =================================================================
 
+import csv
 from datetime import date, datetime, time
+from io import StringIO
 import os
+import shutil
+import tempfile
 import unittest
 
-from woudc_data_registry import parser, processing, util
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from woudc_data_registry import (controller, models, parser, processing,
+                                 util)
 from woudc_data_registry.parser import DOMAINS
 
 
@@ -65,6 +73,55 @@ def resolve_test_data_path(test_data_file):
             return path
 
 
+class ControllerTest(unittest.TestCase):
+    """Test suite for controller.py"""
+
+    def test_iter_files(self):
+        """test recursive file listing"""
+
+        directory = os.path.dirname(resolve_test_data_path(
+            'data/20040709.ECC.2Z.2ZL1.NOAA-CMDL.csv'))
+
+        expected = set()
+        for root, dirs, files in os.walk(directory):
+            for f in files:
+                expected.add(os.path.join(root, f))
+
+        self.assertEqual(set(controller._iter_files(directory)), expected)
+
+        # unlistable directories are skipped, as with os.walk
+        self.assertEqual(list(controller._iter_files('404dir')), [])
+
+        with tempfile.TemporaryDirectory() as directory:
+            subdirectory = os.path.join(directory, 'vanished')
+            os.mkdir(subdirectory)
+            for path in [directory, subdirectory]:
+                with open(os.path.join(path, 'file.csv'), 'w'):
+                    pass
+
+            files = controller._iter_files(directory)
+            self.assertEqual(next(files),
+                             os.path.join(directory, 'file.csv'))
+            shutil.rmtree(subdirectory)
+            self.assertEqual(list(files), [])
+
+        # broken symlinks are listed, symlinked directories are not walked
+        with tempfile.TemporaryDirectory() as directory:
+            os.symlink(os.path.join(directory, '404file.csv'),
+                       os.path.join(directory, 'broken.csv'))
+            os.symlink(os.path.dirname(directory),
+                       os.path.join(directory, 'parent'))
+
+            expected = set()
+            for root, dirs, files in os.walk(directory):
+                for f in files:
+                    expected.add(os.path.join(root, f))
+
+            self.assertEqual(set(controller._iter_files(directory)), expected)
+            self.assertEqual(expected,
+                             {os.path.join(directory, 'broken.csv')})
+
+
 class ParserTest(unittest.TestCase):
     """Test suite for parser.py"""
 
@@ -77,10 +134,52 @@ class ParserTest(unittest.TestCase):
         self.assertIsInstance(parser._get_value_type('test', '022'), str)
         self.assertIsInstance(parser._get_value_type('test', '1.0'), float)
         self.assertIsInstance(parser._get_value_type('test', '1.0-1'), str)
+        self.assertEqual(parser._get_value_type('test', '-12'), -12)
+        self.assertEqual(parser._get_value_type('test', ' 12'), 12)
+        self.assertEqual(parser._get_value_type('test', '-.5'), -0.5)
+        self.assertEqual(parser._get_value_type('test', '1.5E-3'), 0.0015)
+        self.assertEqual(parser._get_value_type('test', '12a'), '12a')
+        self.assertEqual(parser._get_value_type('test', '1.2.3'), '1.2.3')
         self.assertIsInstance(parser._get_value_type('date', '2011-11-11'),
                               date)
         self.assertIsInstance(parser._get_value_type('time', '11:11:11'), time)
 
+        self.assertEqual(parser._get_value_type('Date', '2011-11-09'),
+                         date(2011, 11, 9))
+        self.assertEqual(parser._get_value_type('Date', '2011-1-9'),
+                         date(2011, 1, 9))
+        self.assertEqual(parser._get_value_type('Time', '01:02:03'),
+                         time(1, 2, 3))
+        self.assertEqual(parser._get_value_type('Time', '1:2:3'),
+                         time(1, 2, 3))
+
+        with self.assertRaises(ValueError):
+            parser._get_value_type('Date', '2011-13-09')
+        with self.assertRaises(ValueError):
+            parser._get_value_type('Date', '2011/11/09')
+
+    def test_iter_rows(self):
+        """test Extended CSV tokenizing"""
+
+        contents = util.read_file(resolve_test_data_path(
+            'data/ecsv-space-in-instrument-name.csv'))
+        self.assertNotIn('"', contents)
+
+        for contents_ in [contents, contents.replace('\n', '\r\n'),
+                          contents + '\n', '']:
+            reader = csv.reader(StringIO(contents_))
+            expected = [(reader.line_num, row) for row in reader]
+            self.assertEqual(list(parser._iter_rows(contents_)), expected)
+
+        # quoted values are left to csv.reader
+        contents = 'a,"b,c"\n\nd'
+        self.assertEqual(list(parser._iter_rows(contents)),
+                         [(1, ['a', 'b,c']), (2, []), (3, ['d'])])
+
+        # so are carriage returns, which csv.reader rejects inside a line
+        with self.assertRaises(csv.Error):
+            list(parser._iter_rows('a,b\rc\nd'))
+
     def test_ecsv(self):
         """test Extended CSV handling"""
 
@@ -93,6 +192,12 @@ class ParserTest(unittest.TestCase):
         self.assertEqual('20040709.ECC.2Z.2ZL1.NOAA-CMDL.csv',
                          ecsv.gen_woudc_filename())
 
+        # good file, read from an open file
+        with open(resolve_test_data_path(
+                'data/20040709.ECC.2Z.2ZL1.NOAA-CMDL.csv'), newline='') as fh:
+            ecsv2 = parser.ExtendedCSV(fh)
+        self.assertEqual(ecsv.extcsv, ecsv2.extcsv)
+
         # good file, missing instrument number
         contents = util.read_file(resolve_test_data_path(
             'data/ecsv-missing-instrument-number.csv'))
@@ -182,10 +287,83 @@ class ParserTest(unittest.TestCase):
         with self.assertRaises(parser.MetadataValidationError):
             ecsv.validate_metadata()
 
+    def test_location_bounds(self):
+        """test LOCATION latitude/longitude bounds are inclusive"""
+
+        contents = util.read_file(resolve_test_data_path(
+            'data/ecsv-space-in-instrument-name.csv'))
+
+        for location in ['90.0,180.0,1384', '-90,-180,1384']:
+            ecsv = parser.ExtendedCSV(contents.replace(
+                '22.780,95.520,1384', location))
+            ecsv.validate_metadata()
+
+        for location in ['-90.5,95.520,1384', '22.780,180.5,1384']:
+            ecsv = parser.ExtendedCSV(contents.replace(
+                '22.780,95.520,1384', location))
+            with self.assertRaises(parser.MetadataValidationError):
+                ecsv.validate_metadata()
+
+    def test_invalid_date_time_rows(self):
+        """test malformed dates/times are rejected in any row"""
+
+        contents = util.read_file(resolve_test_data_path(
+            'data/ecsv-space-in-instrument-name.csv'))
+        timestamp = 'UTCOffset,Date,Time\n00:00:00,2011-11-01'
+        self.assertIn(timestamp, contents)
+
+        for row in ['+00:00:00,2004-13-40,00:00:00',
+                    '+00:00:00,2011-11-01,25:61:00']:
+            with self.assertRaises(ValueError):
+                parser.ExtendedCSV(contents.replace(
+                    timestamp, 'UTCOffset,Date,Time\n{}\n00:00:00,'
+                    '2011-11-01'.format(row)))
+
+    def test_check_dataset_versions(self):
+        """test datasets with multiple table definition versions"""
+
+        contents = util.read_file(resolve_test_data_path(
+            'data/ecsv-space-in-instrument-name.csv')).replace(
+            'TotalOzone,1.0,1', 'Broad-band,1.0,1')
+
+        ecsv = parser.ExtendedCSV(contents + '\n#GLOBAL\nTime,Irradiance\n'
+                                  '12:00:00,1.5\n')
+        self.assertTrue(ecsv.check_dataset())
+
+        ecsv = parser.ExtendedCSV(contents + '\n#GLOBAL\nTime\n12:00:00\n')
+        self.assertFalse(ecsv.check_dataset())
+
 
 class ProcessingTest(unittest.TestCase):
     """Test suite for processing.py"""
 
+    def setUp(self):
+        """create a throwaway registry database"""
+
+        self.dirpath = tempfile.mkdtemp()
+        db_url = 'sqlite:///{}'.format(os.path.join(self.dirpath, 'test.db'))
+
+        self.engine = create_engine(db_url)
+        models.base.metadata.create_all(self.engine)
+        self.sessions = []
+
+    def tearDown(self):
+        """remove the throwaway registry database"""
+
+        for session in self.sessions:
+            session.close()
+        self.engine.dispose()
+        shutil.rmtree(self.dirpath)
+
+    def _get_process(self):
+        """returns a Process bound to the throwaway registry database"""
+
+        p = processing.Process()
+        p.registry.session = sessionmaker(bind=self.engine,
+                                          expire_on_commit=False)()
+        self.sessions.append(p.registry.session)
+        return p
+
     def test_process(self):
         """test value typing"""
 
@@ -212,6 +390,49 @@ class ProcessingTest(unittest.TestCase):
         self.assertEqual(p.code, 'NonStandardDataError')
         # self.assertEqual(p.message, 'binary file detected')
 
+    def test_query_station_after_rollback(self):
+        """test cached stations survive a rollback followed by a save"""
+
+        p = self._get_process()
+        session = p.registry.session
+
+        session.execute(models.Country.__table__.insert(), {
+            'identifier': 'ZZZ', 'country_name': 'Test Country',
+            'french_name': 'Pays test', 'wmo_region_id': 'I',
+            'regional_involvement': 'x', 'link': 'x'})
+        session.execute(models.Station.__table__.insert(), {
+            'identifier': '999', 'name': 'Test Station', 'country_id': 'ZZZ',
+            'wmo_region_id': 'I', 'last_validated_datetime': datetime.now(),
+            'x': 0, 'y': 0, 'z': 0})
+        session.commit()
+
+        self.assertEqual(p.query_station('999'), ('Test Station', 'ZZZ'))
+        self.assertIsNone(p.query_station('998'))
+
+        # as after a failed file, then a save for the next one
+        session.rollback()
+        p.registry.save()
+
+        self.assertEqual(p.query_station('999'), ('Test Station', 'ZZZ'))
+
+    def test_save_new(self):
+        """test saving objects which were added concurrently"""
+
+        p = self._get_process()
+        dataset = {'identifier': 'TestDataset'}
+
+        self.assertTrue(p.save_new(models.Dataset(dataset)))
+        # another worker's Process adding the same object
+        other = self._get_process()
+        self.assertFalse(other.save_new(models.Dataset(dataset)))
+
+    def test_confirm_non_interactive(self):
+        """test permission prompts fail without an operator"""
+
+        p = processing.Process()
+        with self.assertRaises(processing.ProcessingError):
+            p.confirm('Add?', interactive=False)
+
 
 class UtilTest(unittest.TestCase):
     """Test suite for util.py"""
@@ -232,21 +453,24 @@ class UtilTest(unittest.TestCase):
         with self.assertRaises(FileNotFoundError):
             contents = util.read_file('404file.dat')
 
+    def test_read_text_file(self):
+        """test reading text files in a single pass"""
+
+        res = resolve_test_data_path('data/20040709.ECC.2Z.2ZL1.NOAA-CMDL.csv')
+        self.assertEqual(util.read_text_file(res), util.read_file(res))
+
+        res = resolve_test_data_path('data/euc-jp.dat')
+        self.assertEqual(util.read_text_file(res), util.read_file(res))
+
+        res = resolve_test_data_path('data/wmo_acronym_vertical_sm.jpg')
+        self.assertIsNone(util.read_text_file(res))
+
     def test_is_binary_string(self):
         """test if the string is binary"""
 
         self.assertFalse(util.is_binary_string('foo'))
         self.assertFalse(util.is_binary_string(b'foo'))
 
-    def test_is_text_file(self):
-        """test if file is text-based"""
-
-        res = resolve_test_data_path('data/20040709.ECC.2Z.2ZL1.NOAA-CMDL.csv')
-        self.assertTrue(util.is_text_file(res))
-
-        res = resolve_test_data_path('data/wmo_acronym_vertical_sm.jpg')
-        self.assertFalse(util.is_text_file(res))
-
     def test_point2geojsongeometry(self):
         """test point GeoJSON geometry creation"""
 
@@ -49,6 +49,10 @@ import io
 
 LOGGER = logging.getLogger(__name__)
 
+# bytes expected in text files, deleted when testing for binary content
+_TEXTCHARS = bytes({7, 8, 9, 10, 12, 13, 27} |
+                   set(range(0x20, 0x100)) - {0x7f})
+
 
 def point2geojsongeometry(x, y, z=None):
     """
@@ -79,28 +83,64 @@ def point2geojsongeometry(x, y, z=None):
     return geometry
 
 
-def read_file(filename, encoding='utf-8'):
+def _decode(data, encoding='utf-8'):
     """
-    read file contents
+    decode file contents, falling back to latin-1
 
-    :param filename: filename
+    :param data: `bytes` of file contents
     :param encoding: encoding (default=utf-8)
 
-    :returns: buffer of file contents
+    :returns: buffer of decoded contents
     """
 
-    LOGGER.debug('Reading file {} (encoding {})'.format(filename, encoding))
-
     try:
-        with io.open(filename, encoding=encoding) as fh:
+        with io.TextIOWrapper(io.BytesIO(data), encoding=encoding) as fh:
             return fh.read().strip()
     except UnicodeDecodeError as err:
         LOGGER.warning('utf-8 decoding failed: {}'.format(err))
         LOGGER.info('Trying latin-1')
-        with io.open(filename, encoding='latin-1') as fh:
+        with io.TextIOWrapper(io.BytesIO(data), encoding='latin-1') as fh:
             return fh.read().strip()
 
 
+def read_file(filename, encoding='utf-8'):
+    """
+    read file contents
+
+    :param filename: filename
+    :param encoding: encoding (default=utf-8)
+
+    :returns: buffer of file contents
+    """
+
+    LOGGER.debug('Reading file {} (encoding {})'.format(filename, encoding))
+
+    with io.open(filename, 'rb') as fh:
+        return _decode(fh.read(), encoding)
+
+
+def read_text_file(filename, encoding='utf-8'):
+    """
+    read file contents unless the file is binary, detecting binary
+    content and decoding from a single read of the file
+
+    :param filename: filename
+    :param encoding: encoding (default=utf-8)
+
+    :returns: buffer of file contents, or `None` if the file is binary
+    """
+
+    LOGGER.debug('Reading file {} (encoding {})'.format(filename, encoding))
+
+    with io.open(filename, 'rb') as fh:
+        data = fh.read()
+
+    if is_binary_string(data[:1024]):
+        return None
+
+    return _decode(data, encoding)
+
+
 def str2bool(value):
     """
     helper function to return Python boolean
@@ -121,21 +161,6 @@ def str2bool(value):
     return value2
 
 
-def is_text_file(file_):
-    """
-    detect if file is of type text
-
-    :param file_: file to be tested
-
-    :returns: `bool` of whether the file is text
-    """
-
-    with open(file_, 'rb') as ff:
-        data = ff.read(1024)
-
-    return not is_binary_string(data)
-
-
 def is_binary_string(string_):
     """
     detect if string is binary (https://stackoverflow.com/a/7392391)
@@ -148,9 +173,7 @@ def is_binary_string(string_):
     if isinstance(string_, str):
         string_ = bytes(string_, 'utf-8')
 
-    textchars = (bytearray({7, 8, 9, 10, 12, 13, 27} |
-                 set(range(0x20, 0x100)) - {0x7f}))
-    return bool(string_.translate(None, textchars))
+    return bool(string_.translate(None, _TEXTCHARS))
 
 
 def json_serial(obj):